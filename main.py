@@ -1,14 +1,26 @@
+import logging
 import os
+import platform
+import re
+import ssl
+import time
 from datetime import datetime, timezone
-from typing import List, Optional
-from fastapi import FastAPI, HTTPException
+from functools import lru_cache
+from typing import AsyncIterator, Dict, List, Literal, Optional, Tuple
+from fastapi import FastAPI, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
+import orjson
+from pydantic import BaseModel, ConfigDict, Field
 from bson import ObjectId
+from pymongo import InsertOne, UpdateOne, WriteConcern
 
 from database import db, create_document, get_documents
 
-app = FastAPI()
+# uvicorn's logger, so messages land alongside the server log
+logger = logging.getLogger("uvicorn.error")
+
+app = FastAPI(default_response_class=ORJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -20,28 +32,113 @@ app.add_middleware(
 
 # Pydantic models for requests
 class MemberCreate(BaseModel):
+    model_config = ConfigDict(extra="forbid", frozen=True)
+
     name: str
 
-class AttendanceScan(BaseModel):
-    token: str
-    action: str  # "IN" or "OUT"
+# Attendance rows are an append-only log; acknowledge on the primary without waiting for the journal
+ATTENDANCE_WRITE_CONCERN = WriteConcern(w=1, j=False)
+attendance_log = db["attendance"].with_options(write_concern=ATTENDANCE_WRITE_CONCERN) if db is not None else None
+
+# $project stages for the list endpoints; Mongo stringifies _id so handlers return documents as-is
+MEMBER_LIST_PROJECTION = {
+    "_id": {"$toString": "$_id"},
+    "name": 1,
+    "present": 1,
+    "last_in": 1,
+    "last_out": 1,
+    "status": {"$cond": ["$present", "Present", "Absent"]},
+}
+ATTENDANCE_PROJECTION = {
+    "_id": {"$toString": "$_id"},
+    "member_id": 1,
+    "action": 1,
+    "timestamp": 1,
+}
+
+# List endpoints stream their cursors, holding at most one batch in memory
+STREAM_BATCH_SIZE = 200
+
+
+async def json_array_response(cursor) -> Response:
+    # Await the first document before the 200 goes out, so an unreachable
+    # database or a failing pipeline still surfaces as an HTTP error
+    try:
+        first = await cursor.next()
+    except StopAsyncIteration:
+        return Response(b"[]", media_type="application/json")
+    return StreamingResponse(_stream_json_array(first, cursor), media_type="application/json")
+
+
+async def _stream_json_array(first: dict, cursor) -> AsyncIterator[bytes]:
+    # one body chunk per STREAM_BATCH_SIZE documents rather than per document
+    parts = [b"[" + orjson.dumps(first)]
+    async for doc in cursor:
+        parts.append(b"," + orjson.dumps(doc))
+        if len(parts) >= STREAM_BATCH_SIZE:
+            yield b"".join(parts)
+            parts = []
+    parts.append(b"]")
+    yield b"".join(parts)
+
 
 # Utility: validate Mongo ObjectId
 
+@lru_cache(maxsize=8192)
+def _oid_cached(id_str: str) -> ObjectId:
+    # ObjectId is immutable, so active members can share one parsed instance
+    return ObjectId(id_str)
+
+
 def oid(id_str: str) -> ObjectId:
     try:
-        return ObjectId(id_str)
+        return _oid_cached(id_str)
     except Exception:
         raise HTTPException(status_code=400, detail="Invalid member id")
 
 
+@app.on_event("startup")
+async def prepare_database():
+    if db is None:
+        return
+    try:
+        # connect now so the first request doesn't pay for server selection and handshakes
+        await db.client.admin.command("ping")
+    except Exception as e:
+        logger.warning("Database ping failed at startup: %s", e)
+        return
+    # create_index is a no-op when the index already exists
+    await db["attendance"].create_index([("member_id", 1), ("timestamp", -1)])
+    await db["member"].create_index([("name", 1)])
+
+
+def _cpu_has_sha_ni() -> Optional[bool]:
+    # Linux only; None when the CPU flags can't be read
+    try:
+        with open("/proc/cpuinfo") as f:
+            return "sha_ni" in f.read()
+    except OSError:
+        return None
+
+
+@app.on_event("startup")
+async def log_hmac_backend():
+    # QR token HMACs cost several times more on CPUs without SHA extensions
+    logger.info(
+        "hmac_backend python=%s openssl=%s sha_ni=%s",
+        platform.python_version(),
+        ssl.OPENSSL_VERSION,
+        _cpu_has_sha_ni(),
+    )
+
+
 @app.get("/")
-def read_root():
+async def read_root():
     return {"message": "Attendance Backend Running"}
 
 
 @app.get("/test")
-def test_database():
+async def test_database():
     response = {
         "backend": "✅ Running",
         "database": "❌ Not Available",
@@ -58,7 +155,7 @@ def test_database():
             response["database_name"] = db.name if hasattr(db, 'name') else "✅ Connected"
             response["connection_status"] = "Connected"
             try:
-                collections = db.list_collection_names()
+                collections = await db.list_collection_names()
                 response["collections"] = collections[:10]
                 response["database"] = "✅ Connected & Working"
             except Exception as e:
@@ -76,74 +173,121 @@ def test_database():
 
 # Members Endpoints
 @app.post("/api/members")
-def create_member(payload: MemberCreate):
+async def create_member(payload: MemberCreate):
     if db is None:
         raise HTTPException(status_code=500, detail="Database not configured")
+    now = datetime.now(timezone.utc)
     doc = {
         "name": payload.name,
         "present": False,
         "last_in": None,
         "last_out": None,
-        "created_at": datetime.now(timezone.utc),
-        "updated_at": datetime.now(timezone.utc),
+        "created_at": now,
+        "updated_at": now,
     }
-    res = db["member"].insert_one(doc)
+    res = await db["member"].insert_one(doc)
     doc["_id"] = str(res.inserted_id)
     return doc
 
 
 @app.get("/api/members")
-def list_members():
+async def list_members():
     if db is None:
         raise HTTPException(status_code=500, detail="Database not configured")
-    members = list(db["member"].find())
-    for m in members:
-        m["_id"] = str(m["_id"])
-        # compute current status from presence flag and times
-        m["status"] = "Present" if m.get("present") else "Absent"
-    return members
+    cursor = db["member"].aggregate([{"$project": MEMBER_LIST_PROJECTION}], batchSize=STREAM_BATCH_SIZE)
+    return await json_array_response(cursor)
 
 
 # QR token generation (time-bound)
 # We will generate a short-lived token by hashing member_id + action + current time slice
 import hmac
-import hashlib
 import base64
+import binascii
 
 SECRET = os.getenv("QR_SECRET", "dev-secret")
+SECRET_BYTES = SECRET.encode()
+# Keyed once; copies reuse the padded-key state instead of re-deriving it per token
+_HMAC_TEMPLATE = hmac.new(SECRET_BYTES, digestmod="sha256")
 TOKEN_WINDOW_SECONDS = 10
 
+# Signatures only change once per window, so cache them per (member_id, action, time slice)
+TOKEN_CACHE_SIZE = 4096
+_TOKEN_CACHE: Dict[Tuple[str, str, int], bytes] = {}
+
+
+# Pre-encoded ":<action>:" separators for the signed "<member_id>:<action>:<ts>" message
+_ACTION_SEPS = {"IN": b":IN:", "OUT": b":OUT:"}
+
+
+def _token_msg(member_id: str, action: str, ts: int) -> bytes:
+    return member_id.encode() + _ACTION_SEPS[action] + str(ts).encode()
+
+
+def _sig_for_slice(member_id: str, action: str, ts: int) -> bytes:
+    key = (member_id, action, ts)
+    sig = _TOKEN_CACHE.get(key)
+    if sig is not None:
+        return sig
+    msg = _token_msg(member_id, action, ts)
+    h = _HMAC_TEMPLATE.copy()
+    h.update(msg)
+    sig = h.digest()
+    _remember_sig(key, sig)
+    return sig
+
+
+def _remember_sig(key: Tuple[str, str, int], sig: bytes) -> None:
+    if len(_TOKEN_CACHE) >= TOKEN_CACHE_SIZE:
+        # dicts keep insertion order: drop the oldest entry
+        _TOKEN_CACHE.pop(next(iter(_TOKEN_CACHE)))
+    _TOKEN_CACHE[key] = sig
+
+
+# Canonical token: 32-byte digest, urlsafe base64, padding stripped
+_TOKEN_RE = re.compile(r"[A-Za-z0-9_-]{43}")
+
+
+def _decode_token(token: str) -> Optional[bytes]:
+    if not _TOKEN_RE.fullmatch(token):
+        return None
+    try:
+        raw = base64.b64decode(token + "=", altchars=b"-_", validate=True)
+    except binascii.Error:
+        return None
+    # the last character carries 2 unused bits; only the canonical spelling is accepted
+    if base64.urlsafe_b64encode(raw).rstrip(b"=") != token.encode():
+        return None
+    return raw
+
 
 def generate_token(member_id: str, action: str, now: Optional[datetime] = None) -> str:
     if action not in ("IN", "OUT"):
         raise HTTPException(status_code=400, detail="Invalid action")
-    now = now or datetime.now(timezone.utc)
     # time slice index
-    ts = int(now.timestamp()) // TOKEN_WINDOW_SECONDS
-    msg = f"{member_id}:{action}:{ts}".encode()
-    sig = hmac.new(SECRET.encode(), msg, hashlib.sha256).digest()
-    token = base64.urlsafe_b64encode(sig).decode().rstrip("=")
-    return token
+    ts = int(now.timestamp() if now else time.time()) // TOKEN_WINDOW_SECONDS
+    sig = _sig_for_slice(member_id, action, ts)
+    return base64.urlsafe_b64encode(sig).decode().rstrip("=")
 
 
 def verify_token(member_id: str, action: str, token: str) -> bool:
-    now = datetime.now(timezone.utc)
-    current_slice = int(now.timestamp()) // TOKEN_WINDOW_SECONDS
+    if _ACTION_SEPS.get(action) is None:
+        return False
+    token_raw = _decode_token(token)
+    if token_raw is None:
+        return False
+    current_slice = int(time.time()) // TOKEN_WINDOW_SECONDS
     for ts in (current_slice, current_slice - 1):  # allow small clock skew
-        msg = f"{member_id}:{action}:{ts}".encode()
-        sig = hmac.new(SECRET.encode(), msg, hashlib.sha256).digest()
-        expected = base64.urlsafe_b64encode(sig).decode().rstrip("=")
-        if hmac.compare_digest(expected, token):
+        if hmac.compare_digest(_sig_for_slice(member_id, action, ts), token_raw):
             return True
     return False
 
 
 @app.get("/api/members/{member_id}/qrs")
-def get_member_qrs(member_id: str):
+async def get_member_qrs(member_id: str):
     # return urls with token for IN and OUT
     if db is None:
         raise HTTPException(status_code=500, detail="Database not configured")
-    m = db["member"].find_one({"_id": oid(member_id)})
+    m = await db["member"].find_one({"_id": oid(member_id)})
     if not m:
         raise HTTPException(status_code=404, detail="Member not found")
     return {
@@ -159,65 +303,109 @@ def get_member_qrs(member_id: str):
     }
 
 
-# Scanning endpoint
-@app.post("/api/scan")
-def scan(payload: AttendanceScan):
-    if db is None:
-        raise HTTPException(status_code=500, detail="Database not configured")
-    # payload.token encodes the time slice; client must provide member_id separately in URL or token must be per-member
-    # We'll expect query params member_id and action inside payload as we defined
-    action = payload.action
-    # Search members to verify token by trying each? Not efficient. Instead, client should send member_id.
-    # To keep API simple, include member_id in token verification path via x-member-id header? We'll extend payload.
-    raise HTTPException(status_code=400, detail="Include member_id in request body as 'member_id'.")
+def attendance_doc(member_id: str, action: str, now: datetime) -> dict:
+    return {
+        "member_id": member_id,
+        "action": action,
+        "timestamp": now,
+        "created_at": now,
+        "updated_at": now,
+    }
 
 
+def presence_update(action: str, now: datetime) -> dict:
+    upd = {"updated_at": now}
+    if action == "IN":
+        upd.update({"present": True, "last_in": now})
+    else:
+        upd.update({"present": False, "last_out": now})
+    return upd
+
+
+# Scanning endpoint
 class AttendanceScan2(BaseModel):
+    model_config = ConfigDict(extra="forbid", frozen=True)
+
     member_id: str
-    action: str  # IN|OUT
+    action: Literal["IN", "OUT"]
     token: str
 
 
 @app.post("/api/scan2")
-def scan2(payload: AttendanceScan2):
+async def scan2(payload: AttendanceScan2):
     if db is None:
         raise HTTPException(status_code=500, detail="Database not configured")
     member_id = payload.member_id
     action = payload.action
     token = payload.token
-    if action not in ("IN", "OUT"):
-        raise HTTPException(status_code=400, detail="Invalid action")
+    # parse the id first so only well-formed member ids reach the token cache
+    member_oid = oid(member_id)
     # verify
     if not verify_token(member_id, action, token):
         raise HTTPException(status_code=401, detail="Invalid or expired token")
 
     # record attendance
     now = datetime.now(timezone.utc)
-    att = {
-        "member_id": member_id,
-        "action": action,
-        "timestamp": now,
-        "created_at": now,
-        "updated_at": now,
-    }
-    db["attendance"].insert_one(att)
+    att = attendance_doc(member_id, action, now)
+    await attendance_log.insert_one(att)
 
     # update member presence
-    upd = {"updated_at": now}
-    if action == "IN":
-        upd.update({"present": True, "last_in": now})
-    else:
-        upd.update({"present": False, "last_out": now})
-    db["member"].update_one({"_id": oid(member_id)}, {"$set": upd})
+    upd = presence_update(action, now)
+    await db["member"].update_one({"_id": member_oid}, {"$set": upd})
 
     return {"status": "ok"}
 
 
+# Each item can add 2 token-cache entries; keep one batch well under TOKEN_CACHE_SIZE
+SCAN_BATCH_MAX_ITEMS = 500
+
+
+class AttendanceScanBatch(BaseModel):
+    model_config = ConfigDict(extra="forbid", frozen=True)
+
+    items: List[AttendanceScan2] = Field(..., max_length=SCAN_BATCH_MAX_ITEMS)
+
+
+@app.post("/api/scan2/batch")
+async def scan2_batch(payload: AttendanceScanBatch):
+    if db is None:
+        raise HTTPException(status_code=500, detail="Database not configured")
+    items = payload.items
+    if not items:
+        return {"status": "ok", "count": 0}
+    # parse ids first so only well-formed member ids reach the token cache
+    member_oids = []
+    for i, item in enumerate(items):
+        try:
+            member_oids.append(oid(item.member_id))
+        except HTTPException:
+            raise HTTPException(status_code=400, detail=f"Invalid member id at index {i}")
+    # verify every scan before writing anything; repeated members hit the token cache
+    for i, item in enumerate(items):
+        if not verify_token(item.member_id, item.action, item.token):
+            raise HTTPException(status_code=401, detail=f"Invalid or expired token at index {i}")
+
+    now = datetime.now(timezone.utc)
+    att_ops = [InsertOne(attendance_doc(item.member_id, item.action, now)) for item in items]
+    await attendance_log.bulk_write(att_ops, ordered=False)
+
+    # ordered so repeated scans of one member apply in request order
+    member_ops = [
+        UpdateOne({"_id": member_oid}, {"$set": presence_update(item.action, now)})
+        for member_oid, item in zip(member_oids, items)
+    ]
+    await db["member"].bulk_write(member_ops)
+
+    return {"status": "ok", "count": len(items)}
+
+
 @app.get("/api/members/{member_id}/attendance")
-def member_attendance(member_id: str, limit: int = 50):
+async def member_attendance(member_id: str, limit: int = Query(50, ge=0)):
     if db is None:
         raise HTTPException(status_code=500, detail="Database not configured")
-    records = list(db["attendance"].find({"member_id": member_id}).sort("timestamp", -1).limit(limit))
-    for r in records:
-        r["_id"] = str(r["_id"])
-    return records
+    pipeline = [{"$match": {"member_id": member_id}}, {"$sort": {"timestamp": -1}}]
+    if limit:  # 0 means no limit, as with cursor.limit(0)
+        pipeline.append({"$limit": limit})
+    pipeline.append({"$project": ATTENDANCE_PROJECTION})
+    cursor = db["attendance"].aggregate(pipeline, batchSize=STREAM_BATCH_SIZE)
+    return await json_array_response(cursor)
@@ -0,0 +1,78 @@
+import asyncio
+
+import orjson
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+
+class FakeCursor:
+    def __init__(self, docs, error=None):
+        self._docs = iter(docs)
+        self._error = error
+
+    async def next(self):
+        if self._error is not None:
+            raise self._error
+        try:
+            return next(self._docs)
+        except StopIteration:
+            raise StopAsyncIteration
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.next()
+
+
+class FakeCollection:
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def aggregate(self, pipeline, **kwargs):
+        return self.cursor
+
+
+def use_members(monkeypatch, cursor):
+    monkeypatch.setattr(main, "db", {"member": FakeCollection(cursor)})
+
+
+@pytest.fixture
+def client():
+    return TestClient(main.app, raise_server_exceptions=False)
+
+
+def test_empty_result_is_empty_array(client, monkeypatch):
+    use_members(monkeypatch, FakeCursor([]))
+    res = client.get("/api/members")
+    assert res.status_code == 200
+    assert res.json() == []
+
+
+def test_single_document_array(client, monkeypatch):
+    doc = {"_id": "0123456789abcdef01234567", "name": "Ada", "status": "Absent"}
+    use_members(monkeypatch, FakeCursor([doc]))
+    res = client.get("/api/members")
+    assert res.status_code == 200
+    assert res.json() == [doc]
+
+
+def test_error_on_first_fetch_is_500(client, monkeypatch):
+    use_members(monkeypatch, FakeCursor([], error=RuntimeError("server selection timeout")))
+    res = client.get("/api/members")
+    assert res.status_code == 500
+    assert not res.text.startswith("[")
+
+
+def test_stream_yields_one_chunk_per_batch():
+    docs = [{"n": i} for i in range(2 * main.STREAM_BATCH_SIZE + 5)]
+
+    async def collect():
+        response = await main.json_array_response(FakeCursor(docs))
+        return [chunk async for chunk in response.body_iterator]
+
+    chunks = asyncio.run(collect())
+    assert len(chunks) == 3
+    assert orjson.loads(b"".join(chunks)) == docs
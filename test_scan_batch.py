@@ -0,0 +1,87 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+MEMBER_A = "0123456789abcdef01234567"
+MEMBER_B = "76543210fedcba9876543210"
+
+
+class FakeCollection:
+    def __init__(self):
+        self.writes = []
+
+    async def insert_one(self, doc):
+        self.writes.append(doc)
+
+    async def update_one(self, flt, update):
+        self.writes.append((flt, update))
+
+    async def bulk_write(self, ops, ordered=True):
+        self.writes.extend(ops)
+
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    fake = {"member": FakeCollection(), "attendance": FakeCollection()}
+    monkeypatch.setattr(main, "db", fake)
+    monkeypatch.setattr(main, "attendance_log", fake["attendance"])
+    return fake
+
+
+@pytest.fixture
+def client():
+    return TestClient(main.app)
+
+
+def scan(member_id, action="IN", token=None):
+    return {
+        "member_id": member_id,
+        "action": action,
+        "token": token if token is not None else main.generate_token(member_id, action),
+    }
+
+
+def assert_no_writes(fake_db):
+    assert fake_db["member"].writes == []
+    assert fake_db["attendance"].writes == []
+
+
+def test_empty_batch(client, fake_db):
+    res = client.post("/api/scan2/batch", json={"items": []})
+    assert res.status_code == 200
+    assert res.json() == {"status": "ok", "count": 0}
+    assert_no_writes(fake_db)
+
+
+def test_batch_over_cap_is_rejected(client, fake_db):
+    items = [scan(MEMBER_A)] * (main.SCAN_BATCH_MAX_ITEMS + 1)
+    res = client.post("/api/scan2/batch", json={"items": items})
+    assert res.status_code == 422
+    assert_no_writes(fake_db)
+
+
+def test_bad_token_reports_index_and_writes_nothing(client, fake_db):
+    wrong = main.generate_token(MEMBER_A, "OUT")
+    items = [scan(MEMBER_A), scan(MEMBER_B, token=wrong), scan(MEMBER_A, "OUT")]
+    res = client.post("/api/scan2/batch", json={"items": items})
+    assert res.status_code == 401
+    assert res.json()["detail"] == "Invalid or expired token at index 1"
+    assert_no_writes(fake_db)
+
+
+def test_bad_member_id_reports_index_and_writes_nothing(client, fake_db):
+    items = [scan(MEMBER_A), scan(MEMBER_B), scan("not-an-id", token="x" * 43)]
+    res = client.post("/api/scan2/batch", json={"items": items})
+    assert res.status_code == 400
+    assert res.json()["detail"] == "Invalid member id at index 2"
+    assert_no_writes(fake_db)
+
+
+def test_valid_batch_writes_every_item(client, fake_db):
+    items = [scan(MEMBER_A), scan(MEMBER_B), scan(MEMBER_A, "OUT")]
+    res = client.post("/api/scan2/batch", json={"items": items})
+    assert res.status_code == 200
+    assert res.json() == {"status": "ok", "count": 3}
+    assert len(fake_db["attendance"].writes) == 3
+    assert len(fake_db["member"].writes) == 3
@@ -0,0 +1,36 @@
+import main
+
+MEMBER_ID = "0123456789abcdef01234567"
+
+
+def test_generated_token_verifies():
+    token = main.generate_token(MEMBER_ID, "IN")
+    assert main.verify_token(MEMBER_ID, "IN", token)
+    assert not main.verify_token(MEMBER_ID, "OUT", token)
+
+
+def test_unknown_action_is_rejected():
+    token = main.generate_token(MEMBER_ID, "IN")
+    assert main.verify_token(MEMBER_ID, "in", token) is False
+
+
+def test_non_canonical_tokens_are_rejected():
+    token = main.generate_token(MEMBER_ID, "IN")
+    variants = [
+        token + "!!",
+        token[:20] + "." + token[20:],
+        token + "=",
+        token + "==",
+        " " + token,
+        token + " ",
+        token + "\n",
+        token.translate(str.maketrans("-_", "+/")),
+    ]
+    # the final character has 2 unused bits, so 3 other spellings decode to the same digest
+    alphabet = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_"
+    base = alphabet.index(token[-1]) & ~0b11
+    variants += [token[:-1] + alphabet[base + i] for i in range(4) if alphabet[base + i] != token[-1]]
+    for variant in variants:
+        if variant == token:
+            continue
+        assert not main.verify_token(MEMBER_ID, "IN", variant), repr(variant)